@@ -4,10 +4,11 @@
 import json
 import queue
 import re
+from collections import deque
 from os import environ
 from socket import gethostname
 from subprocess import run, Popen, PIPE, call
-from threading import Thread
+from threading import Thread, Lock
 from time import sleep, time
 
 import paho.mqtt.client
@@ -25,14 +26,18 @@ MQTT_TIMEOUT = int(environ.get('MQTT_TIMEOUT', '30'))
 MQTT_TOPIC_PREFIX = environ.get('MQTT_TOPIC_PREFIX', 'docker')
 MQTT_QOS = int(environ.get('MQTT_QOS', 1))
 DISCOVERY_TOPIC = f'{HOMEASSISTANT_PREFIX}/binary_sensor/{MQTT_TOPIC_PREFIX}/{DOCKER2MQTT_HOSTNAME}_{{}}/config'
-WATCHED_EVENTS = ('create', 'destroy', 'die', 'pause', 'rename', 'start', 'stop', 'unpause')
+WATCHED_EVENTS = ('create', 'destroy', 'die', 'pause', 'rename', 'start', 'stop', 'unpause', 'health_status', 'oom', 'kill')
 STATS_DELAY_SECONDS = environ.get('STATS_DELAY', 5)
+RESTART_WINDOW_SECONDS = int(environ.get('RESTART_WINDOW', 300))
+# Signals `docker kill` is used to stop a container with, anything else (e.g. HUP for a reload) leaves it running
+KILL_SIGNALS = ('2', '3', '9', '15', 'SIGINT', 'SIGQUIT', 'SIGKILL', 'SIGTERM')
 
 known_containers = {}
 docker_events_cmd = ['docker', 'events', '-f', 'type=container', '--format', '{{json .}}']
 docker_stats_cmd = ['docker', 'stats', '-a', '--format', '{{json .}}', '--no-stream']
 docker_ps_cmd = ['docker', 'ps', '-a', '--format', '{{json .}}']
 invalid_ha_topic_chars = re.compile(r'[^a-zA-Z0-9_-]')
+ps_health_status = re.compile(r'\((healthy|unhealthy|health: starting)\)')
 
 mqtt = paho.mqtt.client.Client()
 
@@ -43,6 +48,10 @@ connected_to_mqtt = False
 
 known_container_stats = {}
 
+known_container_events = {}
+# Restart windows are pruned by the stats thread and appended to by the events loop
+restart_times_lock = Lock()
+
 docker_events = queue.Queue()
 
 docker_system_stats = {
@@ -70,6 +79,9 @@ topics = {
     "net_io": "docker/{}/net_io",
     "pids": "docker/{}/pids",
     "block_io": "docker/{}/block_io",
+    "health": "docker/{}/health",
+    "oom_count": "docker/{}/oom_count",
+    "restarts": "docker/{}/restarts",
     "commands": "docker/{}/commands",
     "home_assistant":{
         "state": f"{HOMEASSISTANT_PREFIX}/sensor/docker-{{}}/state/config",
@@ -82,6 +94,9 @@ topics = {
         "net_io": f"{HOMEASSISTANT_PREFIX}/sensor/docker-{{}}/net_io/config",
         "pids": f"{HOMEASSISTANT_PREFIX}/sensor/docker-{{}}/pids/config",
         "block_io": f"{HOMEASSISTANT_PREFIX}/sensor/docker-{{}}/block_io/config",
+        "health": f"{HOMEASSISTANT_PREFIX}/sensor/docker-{{}}/health/config",
+        "oom_count": f"{HOMEASSISTANT_PREFIX}/sensor/docker-{{}}/oom_count/config",
+        "restarts": f"{HOMEASSISTANT_PREFIX}/sensor/docker-{{}}/restarts/config",
         "stop": f"{HOMEASSISTANT_PREFIX}/button/docker-{{}}/stop/config",
         "start": f"{HOMEASSISTANT_PREFIX}/button/docker-{{}}/start/config",
         "restart": f"{HOMEASSISTANT_PREFIX}/button/docker-{{}}/restart/config",
@@ -258,6 +273,37 @@ def get_container_ps(short_container_id):
         return json.loads(line)
 
 
+def get_health_from_status(status):
+    # `docker ps` appends the health to the status string, e.g. "Up 2 hours (healthy)"
+    match = ps_health_status.search(status)
+    if match is None:
+        return "none"
+
+    return match.group(1).replace("health: ", "")
+
+
+def new_container_events(status):
+    # Counters built purely from the `docker events` stream, no daemon queries needed
+    return {
+        "health": get_health_from_status(status),
+        "oom_count": 0,
+        "killed": False,
+        "crashed": False,
+        "restart_times": deque(),
+    }
+
+
+def count_recent_restarts(container_events):
+    restart_times = container_events['restart_times']
+    window_start = time() - RESTART_WINDOW_SECONDS
+
+    with restart_times_lock:
+        while restart_times and restart_times[0] < window_start:
+            restart_times.popleft()
+
+        return len(restart_times)
+
+
 def post_info_for_container(container_id):
     if container_id not in known_containers.keys():
         log(tag="Error", message=f"Cannot find container for ID {container_id}")
@@ -286,6 +332,12 @@ def post_info_for_container(container_id):
     mqtt_send(topics['pids'].format(container_id), container_stats['pids'])
     mqtt_send(topics['block_io'].format(container_id), container_stats['block_io'])
 
+    container_events = known_container_events.get(container_id)
+    if container_events is not None:
+        mqtt_send(topics['health'].format(container_id), container_events['health'])
+        mqtt_send(topics['oom_count'].format(container_id), container_events['oom_count'])
+        mqtt_send(topics['restarts'].format(container_id), count_recent_restarts(container_events))
+
 
 def register_container(container_entry):
     container_name = container_entry['name']
@@ -423,6 +475,42 @@ def register_container(container_entry):
     block_io_discovery = topics['home_assistant']['block_io'].format(container_id)
     mqtt_send(block_io_discovery, json.dumps(block_io_entity_config), retain=True)
 
+    health_entity_config = base_config | {
+        "qos": MQTT_QOS,
+        "state_topic": topics['health'].format(container_id),
+        "name": f"{container_name} Health",
+        "unique_id": f"{container_id}.health",
+        "entity_category": "diagnostic",
+        "icon": "mdi:heart-pulse"
+    }
+    health_discovery = topics['home_assistant']['health'].format(container_id)
+    mqtt_send(health_discovery, json.dumps(health_entity_config), retain=True)
+
+    oom_count_entity_config = base_config | {
+        "qos": MQTT_QOS,
+        "state_topic": topics['oom_count'].format(container_id),
+        "name": f"{container_name} OOM Kills",
+        "unique_id": f"{container_id}.oom_count",
+        "state_class": "total_increasing",
+        "entity_category": "diagnostic",
+        "icon": "mdi:memory"
+    }
+    oom_count_discovery = topics['home_assistant']['oom_count'].format(container_id)
+    mqtt_send(oom_count_discovery, json.dumps(oom_count_entity_config), retain=True)
+
+    restarts_entity_config = base_config | {
+        "qos": MQTT_QOS,
+        "state_topic": topics['restarts'].format(container_id),
+        "name": f"{container_name} Restarts",
+        "unique_id": f"{container_id}.restarts",
+        "unit_of_measurement": f"per {RESTART_WINDOW_SECONDS}s",
+        "state_class": "measurement",
+        "entity_category": "diagnostic",
+        "icon": "mdi:restart-alert"
+    }
+    restarts_discovery = topics['home_assistant']['restarts'].format(container_id)
+    mqtt_send(restarts_discovery, json.dumps(restarts_entity_config), retain=True)
+
     stop_entity_config = base_config | {
         "qos": MQTT_QOS,
         "command_topic": topics['commands'].format(container_id),
@@ -461,6 +549,10 @@ def register_container(container_entry):
     known_containers[container_id] = container_entry
     known_container_stats[container_id] = empty_container_stats.copy()
 
+    # Keep event counters across renames and MQTT reconnects
+    if container_id not in known_container_events.keys():
+        known_container_events[container_id] = new_container_events(container_entry['status'])
+
     post_info_for_container(container_id)
 
 
@@ -508,6 +600,9 @@ def unregister_container(short_id):
 
     del(known_containers[short_id])
 
+    if short_id in known_container_events.keys():
+        del(known_container_events[short_id])
+
 
 '''
 CONTROL THREADS
@@ -579,6 +674,42 @@ def start_threads():
     docker_events_t.start()
 
 
+def process_counter_event(event_action, event, short_container_id):
+    """Update the in-memory event counters, returns True if the event needs no further processing."""
+    if short_container_id not in known_container_events.keys():
+        return event_action in ('health_status', 'oom', 'kill')
+
+    container_events = known_container_events[short_container_id]
+
+    if event_action == 'health_status':
+        container_events['health'] = event['status'].split(':')[1].strip()
+        post_info_for_container(short_container_id)
+        return True
+    elif event_action == 'oom':
+        container_events['oom_count'] += 1
+        post_info_for_container(short_container_id)
+        return True
+    elif event_action == 'kill':
+        # `docker kill` sends no stop event, so a killing signal marks the following die as requested
+        if event['Actor']['Attributes'].get('signal') in KILL_SIGNALS:
+            container_events['killed'] = True
+        return True
+    elif event_action == 'die':
+        container_events['crashed'] = not container_events['killed']
+        container_events['killed'] = False
+    elif event_action == 'stop':
+        # Only sent for `docker stop`/`docker restart`, after the die, whatever the image's stop signal
+        container_events['crashed'] = False
+    elif event_action == 'start':
+        if container_events['crashed']:
+            with restart_times_lock:
+                container_events['restart_times'].append(time())
+        container_events['crashed'] = False
+        container_events['killed'] = False
+
+    return False
+
+
 def process_events():
     global docker_events, known_containers
 
@@ -590,12 +721,18 @@ def process_events():
         return
 
     event = json.loads(line)
-    if event['status'] not in WATCHED_EVENTS:
+    # Some statuses carry a detail after the action, e.g. "health_status: healthy"
+    event_action = event['status'].split(':')[0]
+    if event_action not in WATCHED_EVENTS:
         return
 
     container_name = event['Actor']['Attributes']['name']
     container_id = event['id']
     short_container_id = container_id[:12]
+
+    if process_counter_event(event_action, event, short_container_id):
+        return
+
     container_status = get_container_ps(short_container_id)
 
     if event['status'] == 'create':
@@ -630,6 +767,10 @@ def process_events():
             known_containers[short_container_id]['image'] = container_status['Image']
             known_containers[short_container_id]['name'] = container_status['Names']
 
+        # No health_status event is sent when a container stops or restarts
+        if short_container_id in known_container_events.keys():
+            known_container_events[short_container_id]['health'] = get_health_from_status(container_status['Status'])
+
     post_info_for_container(short_container_id)
 
 